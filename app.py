@@ -1,8 +1,50 @@
 from flask import Flask, render_template, request, jsonify
+from flask.json.provider import DefaultJSONProvider
+from flask_caching import Cache
 from recommendation_engine import FlightRecommendationEngine
+from llm_service import ERROR_PREFIX
+import hashlib
+import json
 import os
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson, which encodes the large /search payloads much faster."""
+
+    def _options(self):
+        return orjson.OPT_SORT_KEYS if self.sort_keys else 0
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self._options()).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response, skipping the str round-trip
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=self._options()), mimetype=self.mimetype
+        )
+
 
 app = Flask(__name__)
+if HAS_ORJSON:
+    app.json = ORJSONProvider(app)
+
+# Flight/hotel data is immutable after load, so a /search response only depends on its request body
+cache = Cache(app, config={'CACHE_TYPE': 'SimpleCache', 'CACHE_DEFAULT_TIMEOUT': 300})
+
+
+def search_cache_key(data):
+    """Stable cache key for a /search request body (independent of field order)."""
+    digest = hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()
+    return f"search:{digest}"
 
 # Initialize Engine
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -14,18 +56,24 @@ engine = FlightRecommendationEngine(
 )
 engine.load_data()
 
+# Data is immutable after load, so build the dropdown lists once instead of per page view
+ORIGINS = sorted({f.origin for f in engine.flights})
+DESTINATIONS = sorted({f.destination for f in engine.flights})
+# Sample logged-in users for testing
+SAMPLE_USERS = [u for u in engine.users if u['user_type'] == 'logged_in'][:10]
+
 @app.route('/')
 def index():
-    # Pass generic lists for dropdowns
-    origins = sorted(list(set(f['origin'] for f in engine.flights)))
-    destinations = sorted(list(set(f['destination'] for f in engine.flights)))
-    # Sample logged-in users for testing
-    sample_users = [u for u in engine.users if u['user_type'] == 'logged_in'][:10]
-    return render_template('index.html', origins=origins, destinations=destinations, sample_users=sample_users)
+    return render_template('index.html', origins=ORIGINS, destinations=DESTINATIONS, sample_users=SAMPLE_USERS)
 
 @app.route('/search', methods=['POST'])
-def search():
+async def search():
     data = request.json
+    cache_key = search_cache_key(data)
+    cached_body = cache.get(cache_key)
+    if cached_body is not None:
+        return app.response_class(cached_body, mimetype='application/json')
+    
     origin = data.get('origin')
     destination = data.get('destination')
     user_id = data.get('user_id')
@@ -35,7 +83,8 @@ def search():
     if user_id == "guest":
         user_id = None
         
-    results = engine.filter_and_rank(origin, destination, user_id, semantic_query)
+    # The page shows the explanations of the recommended flights and the bad options
+    results = await engine.filter_and_rank_async(origin, destination, user_id, semantic_query, explain=True)
     
     if include_hotels and "error" not in results:
         try:
@@ -48,7 +97,14 @@ def search():
             traceback.print_exc()
             results['hotels_error'] = str(e)
             
-    return jsonify(results)
+    response = jsonify(results)
+    # Cache the encoded body so hits skip both the pipeline and JSON encoding. Hotel and LLM
+    # errors may be transient, so responses carrying them are not cached (like the LLM caches)
+    explained = results.get('recommended', []) + results.get('bad_options_sample', [])
+    llm_failed = any((f.get('llm_explanation') or '').startswith(ERROR_PREFIX) for f in explained)
+    if 'hotels_error' not in results and not llm_failed:
+        cache.set(cache_key, response.get_data())
+    return response
 
 if __name__ == '__main__':
     print("Starting Flask server...")
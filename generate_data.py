@@ -1,7 +1,12 @@
 import json
+import os
 import random
-import uuid
 from datetime import datetime, timedelta
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
 
 # Configuration
 NUM_USERS = 500  # > 300
@@ -21,11 +26,15 @@ CABS = ["Economy", "Business", "First"]
 HOTEL_CHAINS = ["Hilton", "Marriott", "Hyatt", "Sheraton", "Ritz-Carlton", "Holiday Inn", "Local Luxury", "Comfort Inn"]
 ROOM_TYPES = ["Standard King", "Double Queen", "Deluxe Suite", "Executive Room"]
 
+def generate_ids(n):
+    """Returns n random 16-char hex ids drawn from a single os.urandom call (much cheaper than n uuid4 strings)."""
+    raw = os.urandom(8 * n).hex()
+    return [raw[i:i + 16] for i in range(0, 16 * n, 16)]
+
 def generate_users(num_users):
     users = []
-    for _ in range(num_users):
+    for user_id in generate_ids(num_users):
         user_type = random.choice(["guest", "logged_in"])
-        user_id = str(uuid.uuid4())
         
         user = {
             "user_id": user_id,
@@ -48,6 +57,7 @@ def generate_users(num_users):
 
 def generate_hotels():
     hotels = []
+    hotel_ids = iter(generate_ids(50 * len(AIRPORTS)))
     for city in AIRPORTS:
         # Generate ~50 hotel options per city
         for _ in range(50):
@@ -67,7 +77,7 @@ def generate_hotels():
             rating = round(random.uniform(3.0, 5.0), 1)
             
             hotel = {
-                "hotel_id": str(uuid.uuid4()),
+                "hotel_id": next(hotel_ids),
                 "city": city,
                 "name": name,
                 "room_type": room,
@@ -81,7 +91,7 @@ def generate_flight_records(num_records):
     flights = []
     base_date = datetime.now()
     
-    for _ in range(num_records):
+    for flight_id in generate_ids(num_records):
         origin = random.choice(AIRPORTS)
         destination = random.choice([a for a in AIRPORTS if a != origin])
         airline = random.choice(AIRLINES)
@@ -105,7 +115,7 @@ def generate_flight_records(num_records):
         price = round(price, 2)
         
         flight = {
-            "flight_id": str(uuid.uuid4()),
+            "flight_id": flight_id,
             "airline": airline["name"],
             "flight_number": f"{airline['name'][:2].upper()}{random.randint(100, 999)}",
             "origin": origin,
@@ -151,6 +161,15 @@ def assign_history_to_users(users, flights):
             
         user["history"] = history_records
 
+def save_json(records, path):
+    """Writes records as compact JSON (no indentation), via orjson when installed."""
+    if HAS_ORJSON:
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(records))
+    else:
+        with open(path, "w") as f:
+            json.dump(records, f, separators=(",", ":"))
+
 def main():
     print("Generating users...")
     users = generate_users(NUM_USERS)
@@ -165,15 +184,10 @@ def main():
     assign_history_to_users(users, flights)
     
     print("Saving to JSON files...")
-    with open("user_profiles.json", "w") as f:
-        json.dump(users, f, indent=2)
-        
-    with open("flights_data.json", "w") as f:
-        json.dump(flights, f, indent=2)
-        
-    with open("hotels_data.json", "w") as f:
-        json.dump(hotels, f, indent=2)
-        
+    save_json(users, "user_profiles.json")
+    save_json(flights, "flights_data.json")
+    save_json(hotels, "hotels_data.json")
+    
     print(f"Done! Generated {len(users)} users, {len(flights)} flights, and {len(hotels)} independent hotel options.")
 
 if __name__ == "__main__":
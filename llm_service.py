@@ -2,27 +2,68 @@ import os
 import random
 import json
 import re
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import urllib.request
+from collections import OrderedDict
+import numpy as np
 try:
     import google.genai as genai
+    from google.genai import types as genai_types
     HAS_GEMINI = True
 except ImportError:
     HAS_GEMINI = False
+try:
+    import aiohttp
+    HAS_AIOHTTP = True
+except ImportError:
+    HAS_AIOHTTP = False
+
+GEMINI_MODEL = 'gemini-3-pro-preview'
+GEMINI_REST_URL = "https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
+# Seconds to wait for a synchronous REST call (used when the google-genai SDK is not installed)
+GEMINI_REST_TIMEOUT = 60
+EXPLANATION_CACHE_SIZE = 10000
+# Upper bound on in-flight Gemini requests per batch, to stay under the rate limits
+MAX_CONCURRENT_REQUESTS = 8
+# Bump when the explanation prompt changes, to invalidate persisted explanations in one go
+CACHE_VERSION = "v2"
+ERROR_PREFIX = "Error generating explanation"
+EMBEDDING_MODEL = 'text-embedding-004'
+# Cosine similarity above which a stored explanation is reused for a near-duplicate flight
+SEMANTIC_CACHE_THRESHOLD = 0.97
+SEMANTIC_CACHE_SIZE = 10000
+# Static part of every explanation prompt. It goes first (as the system instruction) and
+# the per-flight data last, so repeated calls share an identical prefix that Gemini's
+# implicit prompt caching can reuse.
+EXPLANATION_SYSTEM_INSTRUCTION = """
+You are an AI travel assistant.
+
+You are given one flight, the market average for its route, the user's preferences and a status.
+Task: Explain why this flight has the given status in 1 short sentence (max 20 words).
+- If Recommended: Highlight savings or time benefits explicitly (e.g., "20% cheaper", "3h faster").
+- If Avoid: Highlight downsides explicitly (e.g., "Price is 50% above average", "2x longer duration").
+"""
 
 class LLMService:
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, service_tier="standard"):
         self.api_key = api_key or os.getenv("GOOGLE_API_KEY")
         self.use_mock = not self.api_key
+        # "flex" trades latency for a lower price; meant for offline runs such as the test drivers
+        self.service_tier = service_tier
+        # LRU of Gemini explanations, shared by the sync and async paths
+        self._explanation_cache = OrderedDict()
+        self._explanation_cache_lock = threading.Lock()
         
+        # The google-genai client is optional: without it, calls go to the Gemini REST API
+        self.client = None
         if not self.use_mock and HAS_GEMINI:
             try:
-                genai.configure(api_key=self.api_key)
-                self.model = genai.GenerativeModel('gemini-3-pro-preview')
+                self.client = genai.Client(api_key=self.api_key)
             except Exception as e:
-                print(f"Failed to initialize Gemini: {e}. Falling back to Mock.")
-                self.use_mock = True
-        elif not self.use_mock and not HAS_GEMINI:
-            print("google-generativeai package not installed. Falling back to Mock.")
-            self.use_mock = True
+                print(f"Failed to initialize the Gemini SDK: {e}. Using the Gemini REST API.")
 
     def generate_explanation(self, flight, market_stats, user_prefs=None, status="Recommended"):
         """
@@ -82,27 +123,136 @@ class LLMService:
                 
             return f"Note: {', '.join(reasons)}."
 
-    def _generate_gemini_explanation(self, flight, market_stats, user_prefs, status):
-        """Calls Gemini API for explanation."""
-        prompt = f"""
-        You are an AI travel assistant.
+    async def generate_explanation_async(self, flight, market_stats, user_prefs=None, status="Recommended", session=None):
+        """
+        Async variant of generate_explanation. With an aiohttp session the Gemini REST API
+        is called directly; otherwise the synchronous call runs in a worker thread.
+        """
+        if self.use_mock:
+            return self._generate_mock_explanation(flight, market_stats, user_prefs, status)
+        if session is None:
+            return await asyncio.to_thread(self._generate_gemini_explanation, flight, market_stats, user_prefs, status)
         
-        Context:
-        - Flight: {flight['airline']} to {flight['destination']}, ${flight['price']:.2f}, {flight['duration_minutes']}m, {flight['stops']} stops.
-        - Market Average: ${market_stats['avg_price']:.2f}, {market_stats['avg_duration']:.0f}m.
-        - User Preferences: {user_prefs if user_prefs else 'None'}
-        - Status: {status}
+        key = self._explanation_key(flight, market_stats, user_prefs, status)
+        cached = self._get_cached_explanation(key)
+        if cached is not None:
+            return cached
         
-        Task: Explain why this flight is {status} in 1 short sentence (max 20 words).
-        - If Recommended: Highlight savings or time benefits explicitly (e.g., "20% cheaper", "3h faster").
-        - If Avoid: Highlight downsides explicitly (e.g., "Price is 50% above average", "2x longer duration").
+        payload = self._rest_payload(self._build_explanation_prompt(*key), EXPLANATION_SYSTEM_INSTRUCTION)
+        try:
+            async with session.post(
+                GEMINI_REST_URL.format(model=GEMINI_MODEL), json=payload, headers={"x-goog-api-key": self.api_key}
+            ) as response:
+                response.raise_for_status()
+                data = await response.json()
+            text = data["candidates"][0]["content"]["parts"][0]["text"].strip()
+        except Exception as e:
+            return f"{ERROR_PREFIX}: {str(e)}"
+        
+        self._cache_explanation(key, text)
+        return text
+
+    async def generate_explanations_async(self, jobs, market_stats, user_prefs=None):
         """
+        Explains a batch of (flight, status) jobs concurrently with asyncio.gather,
+        sharing one aiohttp session and keeping at most MAX_CONCURRENT_REQUESTS in flight.
+        Returns the explanations in job order.
+        """
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+        async def explain(flight, status, session=None):
+            async with semaphore:
+                return await self.generate_explanation_async(flight, market_stats, user_prefs, status, session=session)
+
+        if self.use_mock or not HAS_AIOHTTP:
+            return await asyncio.gather(*(explain(flight, status) for flight, status in jobs))
+        async with aiohttp.ClientSession() as session:
+            return await asyncio.gather(*(explain(flight, status, session) for flight, status in jobs))
+
+    def _generate_gemini_explanation(self, flight, market_stats, user_prefs, status):
+        """Calls Gemini API for explanation, reusing cached answers for repeat flights."""
+        key = self._explanation_key(flight, market_stats, user_prefs, status)
+        cached = self._get_cached_explanation(key)
+        if cached is not None:
+            return cached
         
         try:
-            response = self.model.generate_content(prompt)
-            return response.text.strip()
+            text = self._generate_content(
+                self._build_explanation_prompt(*key), EXPLANATION_SYSTEM_INSTRUCTION
+            ).strip()
         except Exception as e:
-            return f"Error generating explanation: {str(e)}"
+            # Errors are returned but never cached
+            return f"{ERROR_PREFIX}: {str(e)}"
+        
+        self._cache_explanation(key, text)
+        return text
+
+    def _generate_content(self, prompt, system_instruction=None):
+        """Synchronous Gemini call through the google-genai client, or the REST API without it."""
+        if self.client is not None:
+            config = None
+            if system_instruction:
+                config = genai_types.GenerateContentConfig(system_instruction=system_instruction)
+            return self.client.models.generate_content(model=GEMINI_MODEL, contents=prompt, config=config).text
+        
+        request = urllib.request.Request(
+            GEMINI_REST_URL.format(model=GEMINI_MODEL),
+            data=json.dumps(self._rest_payload(prompt, system_instruction)).encode(),
+            headers={"x-goog-api-key": self.api_key, "Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request, timeout=GEMINI_REST_TIMEOUT) as response:
+            data = json.load(response)
+        return data["candidates"][0]["content"]["parts"][0]["text"]
+
+    def _rest_payload(self, prompt, system_instruction=None):
+        """generateContent request body for the Gemini REST API."""
+        payload = {"contents": [{"parts": [{"text": prompt}]}]}
+        if system_instruction:
+            payload["systemInstruction"] = {"parts": [{"text": system_instruction}]}
+        if self.service_tier != "standard":
+            payload["serviceTier"] = self.service_tier
+        return payload
+
+    def _explanation_key(self, flight, market_stats, user_prefs, status):
+        """
+        Cache key: flight_id (plus the fields the prompt shows) and status. Market stats are
+        rounded so near-identical contexts hit the same entry; guests have no preferences
+        and therefore share entries.
+        """
+        flight_key = (
+            flight['flight_id'], flight['airline'], flight['destination'],
+            flight['price'], flight['duration_minutes'], flight['stops']
+        )
+        prefs_key = json.dumps(user_prefs, sort_keys=True) if user_prefs else None
+        return (flight_key, round(market_stats['avg_price']), round(market_stats['avg_duration']), prefs_key, status)
+
+    def _get_cached_explanation(self, key):
+        with self._explanation_cache_lock:
+            text = self._explanation_cache.get(key)
+            if text is not None:
+                self._explanation_cache.move_to_end(key)
+            return text
+
+    def _cache_explanation(self, key, text):
+        with self._explanation_cache_lock:
+            self._explanation_cache[key] = text
+            self._explanation_cache.move_to_end(key)
+            if len(self._explanation_cache) > EXPLANATION_CACHE_SIZE:
+                self._explanation_cache.popitem(last=False)
+
+    def _build_explanation_prompt(self, flight_key, avg_price, avg_duration, prefs_key, status):
+        """
+        Builds the per-flight part of the Gemini prompt from an explanation cache key.
+        The instructions live in EXPLANATION_SYSTEM_INSTRUCTION; only variable data goes here.
+        """
+        flight_id, airline, destination, price, duration_minutes, stops = flight_key
+        return f"""
+        Context:
+        - Flight: {airline} to {destination}, ${price:.2f}, {duration_minutes}m, {stops} stops.
+        - Market Average: ${avg_price:.2f}, {avg_duration:.0f}m.
+        - User Preferences: {prefs_key if prefs_key else 'None'}
+        - Status: {status}
+        """
 
     def parse_search_query(self, query):
         """
@@ -128,9 +278,8 @@ class LLMService:
         """
         
         try:
-            response = self.model.generate_content(prompt)
             # Simple cleanup to ensure valid JSON
-            text = response.text.strip()
+            text = self._generate_content(prompt).strip()
             if text.startswith("```json"):
                 text = text[7:-3]
             elif text.startswith("```"):
@@ -166,3 +315,268 @@ class LLMService:
             criteria['max_price'] = int(price_match.group(1))
             
         return criteria
+
+
+class CachedLLMService:
+    """
+    Wraps an LLMService with a persistent (sqlite) cache of Gemini explanations, so repeated
+    runs answer previously explained flights with a local lookup. Everything else is
+    delegated to the wrapped service. Mock explanations are not persisted.
+    """
+
+    def __init__(self, service, path=".llm_cache.sqlite3"):
+        self.service = service
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS explanations (key TEXT PRIMARY KEY, text TEXT NOT NULL)")
+        self._db.commit()
+
+    def __getattr__(self, name):
+        return getattr(self.service, name)
+
+    def _fingerprint(self, flight, market_stats, user_prefs, status):
+        """Stable key from the flight fields the explanation depends on, prefixed with CACHE_VERSION."""
+        fields = {
+            "airline": flight['airline'],
+            "price": flight['price'],
+            "duration_minutes": flight['duration_minutes'],
+            "stops": flight['stops'],
+            "origin": flight['origin'],
+            "destination": flight['destination'],
+            "bad_option_reason": flight.get('bad_option_reason'),
+            "status": status,
+            "avg_price": round(market_stats['avg_price']),
+            "avg_duration": round(market_stats['avg_duration']),
+            "user_prefs": user_prefs or None,
+            "model": GEMINI_MODEL,
+        }
+        digest = hashlib.blake2b(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+        return f"{CACHE_VERSION}:{digest}"
+
+    def _get(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT text FROM explanations WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _put(self, key, text):
+        # Errors are returned but never persisted
+        if text.startswith(ERROR_PREFIX):
+            return
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO explanations (key, text) VALUES (?, ?)", (key, text))
+            self._db.commit()
+
+    def lookup(self, flight, market_stats, user_prefs=None, status="Recommended"):
+        """Persisted explanation of a job, or None if it has not been explained yet (or in mock mode)."""
+        if self.service.use_mock:
+            return None
+        return self._get(self._fingerprint(flight, market_stats, user_prefs, status))
+
+    def get_or_compute(self, key, compute):
+        text = self._get(key)
+        if text is None:
+            text = compute()
+            self._put(key, text)
+        return text
+
+    def generate_explanation(self, flight, market_stats, user_prefs=None, status="Recommended"):
+        if self.service.use_mock:
+            return self.service.generate_explanation(flight, market_stats, user_prefs, status)
+        return self.get_or_compute(
+            self._fingerprint(flight, market_stats, user_prefs, status),
+            lambda: self.service.generate_explanation(flight, market_stats, user_prefs, status)
+        )
+
+    async def generate_explanation_async(self, flight, market_stats, user_prefs=None, status="Recommended", session=None):
+        if self.service.use_mock:
+            return await self.service.generate_explanation_async(flight, market_stats, user_prefs, status, session)
+        key = self._fingerprint(flight, market_stats, user_prefs, status)
+        text = self._get(key)
+        if text is None:
+            text = await self.service.generate_explanation_async(flight, market_stats, user_prefs, status, session)
+            self._put(key, text)
+        return text
+
+    async def generate_explanations_async(self, jobs, market_stats, user_prefs=None):
+        """Answers cached jobs locally and sends only the misses to the wrapped service as one batch."""
+        if self.service.use_mock:
+            return await self.service.generate_explanations_async(jobs, market_stats, user_prefs)
+        keys = [self._fingerprint(flight, market_stats, user_prefs, status) for flight, status in jobs]
+        results = [self._get(key) for key in keys]
+        misses = [i for i, text in enumerate(results) if text is None]
+        if misses:
+            fresh = await self.service.generate_explanations_async([jobs[i] for i in misses], market_stats, user_prefs)
+            for i, text in zip(misses, fresh):
+                results[i] = text
+                self._put(keys[i], text)
+        return results
+
+
+class SemanticCacheLLMService:
+    """
+    Wraps an LLMService and reuses explanations across near-duplicate flights: same status,
+    user preferences, airline, route and stops, with slightly different price/duration.
+    Those fields form an exact-match bucket; within a bucket each job's per-flight prompt is
+    embedded and answered from the most similar stored entry when the cosine similarity
+    exceeds the threshold. Entries are evicted least recently used.
+    Stack it above CachedLLMService, so only the flight's own explanation is ever persisted;
+    jobs the wrapped service has already persisted (its lookup method) are answered before
+    anything is embedded. Mock explanations are computed locally and embeddings need the
+    google-genai SDK, so the cache is bypassed in mock mode or without the SDK.
+    """
+
+    def __init__(self, service, threshold=SEMANTIC_CACHE_THRESHOLD, max_entries=SEMANTIC_CACHE_SIZE):
+        self.service = service
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._client = None
+        # entry id -> (bucket, unit vector, explanation), in LRU order
+        self._entries = OrderedDict()
+        # bucket -> {entry id: None}, the entries that may be compared with a job of that bucket
+        self._buckets = {}
+        self._next_id = 0
+
+    def __getattr__(self, name):
+        return getattr(self.service, name)
+
+    def _bypassed(self):
+        return self.service.use_mock or not HAS_GEMINI
+
+    def _persisted(self, flight, market_stats, user_prefs, status):
+        """Exact answer already persisted by the wrapped service, if it keeps one."""
+        lookup = getattr(self.service, 'lookup', None)
+        return lookup(flight, market_stats, user_prefs, status) if lookup else None
+
+    @staticmethod
+    def _bucket(flight, user_prefs, status):
+        """Fields that must match exactly before two jobs are compared by embedding."""
+        prefs_key = json.dumps(user_prefs, sort_keys=True) if user_prefs else None
+        return (status, prefs_key, flight['airline'], flight['origin'], flight['destination'], flight['stops'])
+
+    def _describe(self, flight, market_stats, user_prefs, status):
+        """Canonical text of a job: the per-flight prompt, with whitespace normalized."""
+        key = self.service._explanation_key(flight, market_stats, user_prefs, status)
+        return " ".join(self.service._build_explanation_prompt(*key).split())
+
+    def _embed(self, texts):
+        """Unit-length embeddings of texts, or None if the embedding call fails."""
+        try:
+            if self._client is None:
+                self._client = genai.Client(api_key=self.service.api_key)
+            result = self._client.models.embed_content(model=EMBEDDING_MODEL, contents=texts)
+            vectors = np.array([embedding.values for embedding in result.embeddings], dtype=np.float32)
+        except Exception as e:
+            print(f"Embedding failed ({e}); semantic cache skipped for this call.")
+            return None
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def _lookup(self, bucket, vector):
+        with self._lock:
+            ids = list(self._buckets.get(bucket, ()))
+            if not ids:
+                return None
+            sims = np.stack([self._entries[entry_id][1] for entry_id in ids]) @ vector
+            best = int(np.argmax(sims))
+            if sims[best] <= self.threshold:
+                return None
+            self._entries.move_to_end(ids[best])
+            return self._entries[ids[best]][2]
+
+    def _store(self, bucket, vector, text):
+        # Errors are returned but never cached
+        if text.startswith(ERROR_PREFIX):
+            return
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (bucket, vector, text)
+            self._buckets.setdefault(bucket, {})[entry_id] = None
+            if len(self._entries) > self.max_entries:
+                old_id, (old_bucket, _, _) = self._entries.popitem(last=False)
+                del self._buckets[old_bucket][old_id]
+                if not self._buckets[old_bucket]:
+                    del self._buckets[old_bucket]
+
+    def generate_explanation(self, flight, market_stats, user_prefs=None, status="Recommended"):
+        if self._bypassed():
+            return self.service.generate_explanation(flight, market_stats, user_prefs, status)
+        text = self._persisted(flight, market_stats, user_prefs, status)
+        if text is not None:
+            return text
+        vectors = self._embed([self._describe(flight, market_stats, user_prefs, status)])
+        if vectors is None:
+            return self.service.generate_explanation(flight, market_stats, user_prefs, status)
+        bucket = self._bucket(flight, user_prefs, status)
+        text = self._lookup(bucket, vectors[0])
+        if text is None:
+            text = self.service.generate_explanation(flight, market_stats, user_prefs, status)
+            self._store(bucket, vectors[0], text)
+        return text
+
+    async def generate_explanation_async(self, flight, market_stats, user_prefs=None, status="Recommended", session=None):
+        if self._bypassed():
+            return await self.service.generate_explanation_async(flight, market_stats, user_prefs, status, session)
+        text = self._persisted(flight, market_stats, user_prefs, status)
+        if text is not None:
+            return text
+        vectors = await asyncio.to_thread(self._embed, [self._describe(flight, market_stats, user_prefs, status)])
+        if vectors is None:
+            return await self.service.generate_explanation_async(flight, market_stats, user_prefs, status, session)
+        bucket = self._bucket(flight, user_prefs, status)
+        text = self._lookup(bucket, vectors[0])
+        if text is None:
+            text = await self.service.generate_explanation_async(flight, market_stats, user_prefs, status, session)
+            self._store(bucket, vectors[0], text)
+        return text
+
+    async def generate_explanations_async(self, jobs, market_stats, user_prefs=None):
+        """
+        Answers persisted jobs first, embeds the rest in one call, answers near-duplicates of
+        stored entries locally, and sends one representative per group of near-identical
+        misses to the wrapped service.
+        """
+        if self._bypassed() or not jobs:
+            return await self.service.generate_explanations_async(jobs, market_stats, user_prefs)
+        results = [self._persisted(flight, market_stats, user_prefs, status) for flight, status in jobs]
+        pending = [i for i, text in enumerate(results) if text is None]
+        if not pending:
+            return results
+        
+        texts = [self._describe(jobs[i][0], market_stats, user_prefs, jobs[i][1]) for i in pending]
+        vectors = await asyncio.to_thread(self._embed, texts)
+        if vectors is None:
+            fresh = await self.service.generate_explanations_async([jobs[i] for i in pending], market_stats, user_prefs)
+            for i, text in zip(pending, fresh):
+                results[i] = text
+            return results
+        
+        # From here on jobs are addressed by their position p in pending (and vectors)
+        buckets = [self._bucket(jobs[i][0], user_prefs, jobs[i][1]) for i in pending]
+        for p, i in enumerate(pending):
+            results[i] = self._lookup(buckets[p], vectors[p])
+        # Misses are grouped per bucket; each group's first job (its leader) is sent for all
+        leaders, followers = {}, {}
+        for p, i in enumerate(pending):
+            if results[i] is not None:
+                continue
+            group = leaders.setdefault(buckets[p], [])
+            if group:
+                sims = vectors[group] @ vectors[p]
+                best = int(np.argmax(sims))
+                if sims[best] > self.threshold:
+                    followers[p] = group[best]
+                    continue
+            group.append(p)
+        
+        to_send = [p for group in leaders.values() for p in group]
+        if to_send:
+            fresh = await self.service.generate_explanations_async(
+                [jobs[pending[p]] for p in to_send], market_stats, user_prefs
+            )
+            for p, text in zip(to_send, fresh):
+                results[pending[p]] = text
+                self._store(buckets[p], vectors[p], text)
+        for p, leader in followers.items():
+            results[pending[p]] = results[pending[leader]]
+        return results
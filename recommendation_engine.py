@@ -1,156 +1,469 @@
 import json
-import copy
-import statistics
-from collections import Counter
+import os
+import pickle
+import sys
+import asyncio
+import functools
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
 from datetime import datetime
+from operator import attrgetter
+import numpy as np
 from llm_service import LLMService
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+try:
+    import ijson
+    HAS_IJSON = True
+except ImportError:
+    HAS_IJSON = False
+# The numba scoring kernel is opt-in (FLIGHT_ENGINE_NUMBA=1): its import and kernel load cost
+# more than the vectorized NumPy scoring saves on this dataset
+HAS_NUMBA = False
+if os.environ.get('FLIGHT_ENGINE_NUMBA') == '1':
+    try:
+        import numba
+        HAS_NUMBA = True
+    except ImportError:
+        pass
+
+# Heuristic score weights: Score = (Price * w_p) + (Duration_minutes * w_d) + (Stops * w_s)
+WEIGHT_PRICE = 0.4
+WEIGHT_DURATION = 4.0
+WEIGHT_STOPS = 50
+
+# Bump when the parsed flight state changes, to invalidate existing .pkl caches
+FLIGHTS_CACHE_VERSION = 2
+# Per-flight NumPy columns (struct-of-arrays) built by _load_flights, with their dtypes
+_FLIGHT_COLUMNS = {
+    '_prices': np.float64,
+    '_durations': np.int32,
+    '_stops': np.int8,
+    '_hours': np.uint8,
+    '_airline_codes': np.int16,
+    '_origins': np.int16,
+    '_destinations': np.int16,
+}
+# Number of (route, user, semantic query) rankings memoized per engine
+RANK_CACHE_SIZE = 1024
+# Initial row capacity of the column buffers while streaming; they grow by doubling
+INITIAL_FLIGHT_CAPACITY = 1024
+# Engine attributes built by _load_flights, i.e. what the .pkl cache holds
+_FLIGHT_STATE = ('flights', '_airport_codes', '_airline_id', *_FLIGHT_COLUMNS)
+
+
+def _load_records(path):
+    """Parses a JSON data file, with orjson (several times faster than json) when installed."""
+    if HAS_ORJSON:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def _iter_records(path):
+    """
+    Yields the records of a data file one at a time. JSON arrays are streamed with ijson
+    when installed, so the raw file and the whole parse tree are never held at once.
+    """
+    if HAS_IJSON:
+        with open(path, 'rb') as f:
+            yield from ijson.items(f, 'item', use_float=True)
+    else:
+        yield from _load_records(path)
+
+
+@dataclass(slots=True, frozen=True)
+class Flight:
+    """
+    Immutable flight record. Slots avoid a per-record __dict__, which makes 30k flights
+    several times smaller than the equivalent dicts. Per-request annotations are never
+    stored on it; see FlightRecommendationEngine.filter_and_rank.
+    """
+    flight_id: str
+    airline: str
+    flight_number: str
+    origin: str
+    destination: str
+    departure_time: str
+    arrival_time: str
+    duration_minutes: int
+    stops: int
+    price: float
+    reliability_score: float
+
+    def to_dict(self):
+        return dict(zip(self.__slots__, _flight_values(self)))
+
+
+# Reads every Flight field in one C-level call (returns a tuple in __slots__ order)
+_flight_values = attrgetter(*Flight.__slots__)
+
+
+if HAS_NUMBA:
+    @numba.njit(cache=True)
+    def _score_and_topk(prices, durations, stops, airline_codes, idx, preferred_airlines, prefers_direct, k,
+                        weight_price, weight_duration, weight_stops):
+        """
+        Fused scoring kernel: base score, preference boosts and top-k selection in one pass.
+        The k best positions are kept in a small sorted buffer. Returns (scores, top) where
+        top lists the winning positions in ascending score order.
+        """
+        n = idx.shape[0]
+        scores = np.empty(n, dtype=np.float64)
+        top_scores = np.full(k, np.inf)
+        top_pos = np.full(k, -1, dtype=np.intp)
+        for pos in range(n):
+            i = idx[pos]
+            multiplier = 1.0
+            if preferred_airlines[airline_codes[i]]:
+                multiplier *= 0.8
+            if prefers_direct and stops[i] == 0:
+                multiplier *= 0.8
+            score = ((prices[i] * weight_price) + (durations[i] * weight_duration)
+                     + (stops[i] * weight_stops)) * multiplier
+            scores[pos] = score
+            # Insert into the sorted buffer; equal scores keep the earlier position first
+            if score < top_scores[k - 1]:
+                j = k - 1
+                while j > 0 and top_scores[j - 1] > score:
+                    top_scores[j] = top_scores[j - 1]
+                    top_pos[j] = top_pos[j - 1]
+                    j -= 1
+                top_scores[j] = score
+                top_pos[j] = pos
+        return scores, top_pos[:min(n, k)]
+
+
+# Outcome of the pure ranking step: candidate flight indices, their scores and annotations,
+# and positions (into idx) of each result category. Arrays are read-only since it is memoized.
+_Ranking = namedtuple('_Ranking', 'idx scores annotations top fastest cheapest bad route_stats')
 
 
 ## Main Flight Recommendation Engine
 
 class FlightRecommendationEngine:
-    def __init__(self, user_profiles_path, flights_data_path):
+    def __init__(self, user_profiles_path, flights_data_path, llm_service=None):
         self.user_profiles_path = user_profiles_path
         self.flights_data_path = flights_data_path
         self.users = []
         self.flights = []
         self.hotels = []
         self.user_map = {}
-        self.llm_service = LLMService() # Initialize LLM Service (Auto-detects Mock/Real)
+        # Struct-of-arrays view of the numeric flight fields, built in load_data
+        self._prices = np.empty(0, dtype=np.float64)
+        self._durations = np.empty(0, dtype=np.int32)
+        self._origins = np.empty(0, dtype=np.int16)
+        self._destinations = np.empty(0, dtype=np.int16)
+        self._stops = np.empty(0, dtype=np.int8)
+        self._airline_codes = np.empty(0, dtype=np.int16)
+        self._hours = np.empty(0, dtype=np.uint8)
+        self._airport_codes = {}
+        self._airline_id = {}
+        self._route_index = {}
+        self._market_stats = {}
+        self._user_history = {}
+        self._hotels_by_city = {}
+        self.llm_service = llm_service or LLMService() # Initialize LLM Service (Auto-detects Mock/Real)
+        # Per-engine memo of _rank_uncached; cleared whenever data is (re)loaded
+        self._rank_cached = functools.lru_cache(maxsize=RANK_CACHE_SIZE)(self._rank_uncached)
 
     def load_data(self):
         """Loads user and flight data from JSON files."""
         try:
-            with open(self.user_profiles_path, 'r') as f:
-                self.users = json.load(f)
-                self.user_map = {u['user_id']: u for u in self.users}
+            self._rank_cached.cache_clear()
+            self.users = _load_records(self.user_profiles_path)
+            self.user_map = {u['user_id']: u for u in self.users}
             
-            with open(self.flights_data_path, 'r') as f:
-                self.flights = json.load(f)
+            self._load_flights_cached()
+            self._build_route_index()
+            self._build_history_index()
             
             try:
-                with open('hotels_data.json', 'r') as f:
-                    self.hotels = json.load(f)
+                self.hotels = _load_records('hotels_data.json')
             except FileNotFoundError:
                 print("Warning: hotels_data.json not found.")
+            self._build_hotel_index()
+            self._warm_up_scoring()
 
             print(f"Loaded {len(self.users)} users, {len(self.flights)} flights, and {len(self.hotels)} hotels.")
         except FileNotFoundError as e:
             print(f"Error loading data: {e}")
 
-    def identify_bad_options(self, flights):
+    def _load_flights_cached(self):
+        """
+        Restores the parsed flights from a pickle next to the data file (flights_data.pkl),
+        which is several times faster than parsing the JSON again. The pickle is rebuilt
+        whenever the data file is newer than it or it was written by another version.
+        Flights are stored as plain field tuples, so the pickle does not depend on the module
+        path of Flight (which is __main__ when this file is run as a script).
+        """
+        cache_path = os.path.splitext(self.flights_data_path)[0] + '.pkl'
+        try:
+            if os.path.getmtime(cache_path) >= os.path.getmtime(self.flights_data_path):
+                with open(cache_path, 'rb') as f:
+                    version, state = pickle.load(f)
+                if version == FLIGHTS_CACHE_VERSION:
+                    state['flights'] = [Flight(*values) for values in state['flights']]
+                    for name in _FLIGHT_STATE:
+                        setattr(self, name, state[name])
+                    return
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Ignoring unreadable flight cache {cache_path}: {e}")
+        
+        self._load_flights(_iter_records(self.flights_data_path))
+        state = {name: getattr(self, name) for name in _FLIGHT_STATE}
+        state['flights'] = [_flight_values(f) for f in self.flights]
+        try:
+            # Write then rename, so a concurrent run never reads a half-written pickle
+            with open(cache_path + '.tmp', 'wb') as f:
+                pickle.dump((FLIGHTS_CACHE_VERSION, state), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(cache_path + '.tmp', cache_path)
+        except OSError as e:
+            print(f"Could not write flight cache {cache_path}: {e}")
+
+    def _load_flights(self, records):
+        """
+        Consumes flight records in a single pass into Flight objects, writing the numeric fields
+        straight into NumPy columns (struct-of-arrays) for vectorized per-request work.
+        Airports and airlines are stored as small integer codes (see self._airport_codes, self._airline_id).
+        """
+        self.flights = []
+        self._airport_codes = {}
+        self._airline_id = {}
+        for name, dtype in _FLIGHT_COLUMNS.items():
+            setattr(self, name, np.empty(INITIAL_FLIGHT_CAPACITY, dtype=dtype))
+        
+        for record in records:
+            self._append_flight(record)
+        
+        # Trim the buffers to the loaded size (copying, so the spare capacity is released)
+        n = len(self.flights)
+        for name in _FLIGHT_COLUMNS:
+            setattr(self, name, getattr(self, name)[:n].copy())
+
+    def _append_flight(self, record):
+        """Adds one parsed flight record: a Flight object plus one row in every column buffer."""
+        # Normalize case once so lookups never need per-flight .upper() calls, and intern the
+        # heavily repeated airport/airline strings so every flight shares one copy of each
+        record['origin'] = sys.intern(record['origin'].upper())
+        record['destination'] = sys.intern(record['destination'].upper())
+        record['airline'] = sys.intern(record['airline'])
+        f = Flight(**record)
+        
+        n = len(self.flights)
+        if n == len(self._prices):
+            for name in _FLIGHT_COLUMNS:
+                column = getattr(self, name)
+                grown = np.empty(2 * n, dtype=column.dtype)
+                grown[:n] = column
+                setattr(self, name, grown)
+        
+        codes = self._airport_codes
+        self._prices[n] = f.price
+        self._durations[n] = f.duration_minutes
+        self._stops[n] = f.stops
+        # Departure hour from the ISO timestamp ("YYYY-MM-DDTHH:MM:SS...")
+        self._hours[n] = int(f.departure_time[11:13])
+        self._airline_codes[n] = self._airline_id.setdefault(f.airline, len(self._airline_id))
+        self._origins[n] = codes.setdefault(f.origin, len(codes))
+        self._destinations[n] = codes.setdefault(f.destination, len(codes))
+        self.flights.append(f)
+
+    def _build_route_index(self):
+        """
+        Maps (origin, destination) -> array of flight indices, so route lookup is O(1),
+        and precomputes each route's market stats.
+        """
+        # One stable sort of the (origin, destination) code pairs groups each route's flights
+        # contiguously, in their original order
+        n_codes = len(self._airport_codes)
+        keys = self._origins.astype(np.int32) * n_codes + self._destinations
+        order = np.argsort(keys, kind='stable').astype(np.intp)
+        route_keys, starts = np.unique(keys[order], return_index=True)
+        airports = list(self._airport_codes)
+        self._route_index = {
+            (airports[key // n_codes], airports[key % n_codes]): idx
+            for key, idx in zip(route_keys.tolist(), np.split(order, starts[1:]))
+        }
+        self._market_stats = {route: self._compute_market_stats(idx) for route, idx in self._route_index.items()}
+
+    def _compute_market_stats(self, idx):
+        """Average price and duration of the flights at idx, plus the 'bad option' thresholds."""
+        avg_price = float(self._prices[idx].mean())
+        avg_duration = float(self._durations[idx].mean())
+        return {
+            "avg_price": avg_price,
+            "avg_duration": avg_duration,
+            # Simple thresholds: > 1.5x average price OR > 2.0x average duration
+            "price_threshold": avg_price * 1.5,
+            "duration_threshold": avg_duration * 2.0,
+        }
+
+    def _build_history_index(self):
+        """
+        Encodes each user's booking history once: the airline codes of the history records
+        and whether the user mostly flies direct. Airlines that never appear in the flight
+        data are dropped, since they cannot match any flight.
+        """
+        self._user_history = {}
+        for user in self.users:
+            history = user.get('history', [])
+            # Enhanced logic using embedded details
+            records = [r for r in history if 'airline' in r]
+            airlines = np.array(
+                [self._airline_id[r['airline']] for r in records if r['airline'] in self._airline_id], dtype=np.int16
+            )
+            direct_flight_count = sum(1 for r in records if r.get('stops', 1) == 0)
+            prefers_direct = (len(history) > 0) and ((direct_flight_count / len(history)) > 0.5)
+            self._user_history[user['user_id']] = (airlines, prefers_direct)
+
+    def _warm_up_scoring(self):
+        """
+        Loads (or compiles, on the very first run) the numba scoring kernel now, so the first
+        search does not pay for it. The kernel is compiled with cache=True, so later processes
+        reuse the machine code from __pycache__.
+        """
+        if HAS_NUMBA and self.flights:
+            self._score_candidates(np.zeros(1, dtype=np.intp))
+
+    def _build_hotel_index(self):
+        """Buckets hotels by city once, each bucket sorted by rating descending."""
+        hotels_by_city = defaultdict(list)
+        for h in self.hotels:
+            hotels_by_city[h['city'].upper()].append(h)
+        self._hotels_by_city = {
+            city: sorted(hotels, key=lambda x: x['rating'], reverse=True)
+            for city, hotels in hotels_by_city.items()
+        }
+
+    def identify_bad_options(self, idx, market_stats=None):
         """
         Identifies 'bad' flight options based on price and duration relative to the average.
-        Adds 'is_bad_option' flag and 'bad_option_reason'.
+        Takes an array of indices into self.flights (and optionally their precomputed market
+        stats) and returns a boolean mask over idx plus {flight_index: bad_option_reason}
+        for the flagged ones.
         """
-        if not flights:
-            return flights
+        if len(idx) == 0:
+            return np.zeros(0, dtype=bool), {}
 
-        prices = [f['price'] for f in flights]
-        durations = [f['duration_minutes'] for f in flights]
+        if market_stats is None:
+            market_stats = self._compute_market_stats(idx)
+        avg_price = market_stats['avg_price']
+        avg_duration = market_stats['avg_duration']
         
-        avg_price = statistics.mean(prices)
-        avg_duration = statistics.mean(durations)
+        bad_price = self._prices[idx] > market_stats['price_threshold']
+        bad_duration = self._durations[idx] > market_stats['duration_threshold']
         
-        # Simple thresholds: > 1.5x average price OR > 2.0x average duration
-        price_threshold = avg_price * 1.5
-        duration_threshold = avg_duration * 2.0
+        bad_mask = bad_price | bad_duration
         
-        for flight in flights:
-            flight['is_bad_option'] = False
-            flight['bad_option_reason'] = None
-            
+        # Reason strings are only built for the (few) flagged rows
+        bad_reasons = {}
+        for pos in np.flatnonzero(bad_mask).tolist():
+            flight = self.flights[idx[pos]]
             reasons = []
-            if flight['price'] > price_threshold:
-                reasons.append(f"Price (${flight['price']}) is significantly higher than average (${avg_price:.2f}).")
+            if bad_price[pos]:
+                reasons.append(f"Price (${flight.price}) is significantly higher than average (${avg_price:.2f}).")
             
-            if flight['duration_minutes'] > duration_threshold:
-                reasons.append(f"Duration ({flight['duration_minutes']}m) is significantly longer than average ({avg_duration:.0f}m).")
+            if bad_duration[pos]:
+                reasons.append(f"Duration ({flight.duration_minutes}m) is significantly longer than average ({avg_duration:.0f}m).")
                 
-            if reasons:
-                flight['is_bad_option'] = True
-                flight['bad_option_reason'] = " ".join(reasons)
+            bad_reasons[int(idx[pos])] = " ".join(reasons)
                 
-        return flights
+        return bad_mask, bad_reasons
 
-    def _calculate_score(self, flight, weight_price=0.4, weight_duration=4.0, weight_stops=50):
+    def _calculate_score(self, idx, weight_price=WEIGHT_PRICE, weight_duration=WEIGHT_DURATION, weight_stops=WEIGHT_STOPS):
         """
-        Calculates a base score for a flight (Lower is better).
+        Calculates base scores for the flights at idx (Lower is better).
         Weights are heuristic.
         """
-        # Score = (Price * w_p) + (Duration_minutes * w_d) + (Stops * w_s)
         # Note: Normalize inputs or adjust weights if scales are vastly different.
         # Here we rely on tuning weights for the specific data range.
-        score = (flight['price'] * weight_price) + \
-                (flight['duration_minutes'] * weight_duration) + \
-                (flight['stops'] * weight_stops)
-        return score
+        scores = (self._prices[idx] * weight_price) + \
+                 (self._durations[idx] * weight_duration) + \
+                 (self._stops[idx].astype(np.float64) * weight_stops)
+        return scores
 
-    def recommend_guest(self, flights):
+    @staticmethod
+    def _smallest_k(values, k=20):
         """
-        Recommendation logic for guest users.
-        Rank by lowest score (Price, Duration, Stops).
+        Returns the positions of the k smallest values in ascending order (ties by position).
+        A partial selection finds the k-th smallest value; every position at or below it is
+        kept, so ties at the cut-off are decided by position like a full stable sort.
         """
+        if len(values) > k:
+            kth = np.partition(values, k - 1)[k - 1]
+            candidates = np.flatnonzero(values <= kth)
+        else:
+            candidates = np.arange(len(values))
+        return candidates[np.argsort(values[candidates], kind='stable')][:k]
+
+    def _score_candidates(self, idx, preferred_airlines=None, prefers_direct=False, k=20):
+        """
+        Scores the flights at idx (Lower is better) with a 20% boost (reduction in score) for
+        each matching preference. preferred_airlines is a boolean table indexed by airline code.
+        Returns (scores aligned with idx, positions of the k best in ascending score order).
+        """
+        if preferred_airlines is None:
+            preferred_airlines = np.zeros(len(self._airline_id), dtype=bool)
         
-        for flight in flights:
-            flight['score'] = self._calculate_score(flight)
-            
-        # Sort by score ascending
-        ranked_flights = sorted(flights, key=lambda x: x['score'])
-        return ranked_flights
+        if HAS_NUMBA:
+            return _score_and_topk(
+                self._prices, self._durations, self._stops, self._airline_codes, idx,
+                preferred_airlines, prefers_direct, k, WEIGHT_PRICE, WEIGHT_DURATION, WEIGHT_STOPS
+            )
+        
+        multiplier = np.where(preferred_airlines[self._airline_codes[idx]], 0.8, 1.0)
+        multiplier *= np.where((self._stops[idx] == 0) & prefers_direct, 0.8, 1.0)
+        scores = self._calculate_score(idx) * multiplier
+        return scores, self._smallest_k(scores, k)
+
+    def recommend_guest(self, idx):
+        """
+        Recommendation logic for guest users.
+        Scores by Price, Duration, Stops; returns (scores aligned with idx, positions of the top 20).
+        """
+        return self._score_candidates(idx)
 
-    def recommend_login(self, user_id, flights):
+    def recommend_login(self, user_id, idx, annotations):
         """
         Personalized recommendation.
         Boosts score based on user history: Airline preference and Direct flight preference.
+        Returns (scores aligned with idx, positions of the top 20) and records boost_reason in annotations.
         """
         user = self.user_map.get(user_id)
         if not user:
             print(f"User {user_id} not found, defaulting to guest recommendation.")
-            return self.recommend_guest(flights)
+            return self.recommend_guest(idx)
             
-        history = user.get('history', [])
-        
-        # 1. Analyze History
-        airline_counts = Counter()
-        direct_flight_count = 0
-        total_history = len(history)
-        
-        for record in history:
-            # Enhanced logic using embedded details
-            if 'airline' in record:
-                airline_counts[record['airline']] += 1
-                if record.get('stops', 1) == 0:
-                    direct_flight_count += 1
-            else:
-                 pass
-        
-        preferred_airlines = [airline for airline, count in airline_counts.items() if count >= 3]
-        prefers_direct = (total_history > 0) and ((direct_flight_count / total_history) > 0.5)
+        # 1. Analyze History (encoded once in load_data)
+        history_airlines, prefers_direct = self._user_history[user_id]
+        airline_counts = np.bincount(history_airlines, minlength=len(self._airline_id))
+        preferred_airlines = airline_counts >= 3
 
-        # 2. Score with Boosts
-        for flight in flights:
-            base_score = self._calculate_score(flight)
-            multiplier = 1.0
-            
-            # Boost for preferred airline
-            if flight['airline'] in preferred_airlines:
-                multiplier *= 0.8 # 20% boost (reduction in score)
-                flight['boost_reason'] = f"Preferred Airline: {flight['airline']}"
-                
-            # Boost for direct flight preference
-            if prefers_direct and flight['stops'] == 0:
-                multiplier *= 0.8
-                if 'boost_reason' in flight:
-                    flight['boost_reason'] += ", Preferred Direct Flight"
+        # 2. Record boost reasons for the matching flights
+        airline_boost = preferred_airlines[self._airline_codes[idx]]
+        direct_boost = (self._stops[idx] == 0) & prefers_direct
+        
+        for pos in np.flatnonzero(airline_boost | direct_boost).tolist():
+            flight_index = int(idx[pos])
+            ann = annotations[flight_index]
+            if airline_boost[pos]:
+                ann['boost_reason'] = f"Preferred Airline: {self.flights[flight_index].airline}"
+            if direct_boost[pos]:
+                if 'boost_reason' in ann:
+                    ann['boost_reason'] += ", Preferred Direct Flight"
                 else:
-                    flight['boost_reason'] = "Preferred Direct Flight"
-            
-            flight['score'] = base_score * multiplier
+                    ann['boost_reason'] = "Preferred Direct Flight"
             
-        # Sort
-        ranked_flights = sorted(flights, key=lambda x: x['score'])
-        return ranked_flights
+        # 3. Score with Boosts
+        return self._score_candidates(idx, preferred_airlines, prefers_direct)
 
     def recommend_hotels(self, city, top_k=3):
         """
@@ -160,112 +473,135 @@ class FlightRecommendationEngine:
             print("No hotels loaded.")
             return []
             
-        relevant = [h for h in self.hotels if h['city'].upper() == city.upper()]
-        # Sort by rating descending
-        ranked = sorted(relevant, key=lambda x: x['rating'], reverse=True)
-        return ranked[:top_k]
+        # Buckets are pre-sorted by rating descending in load_data
+        return self._hotels_by_city.get(city.upper(), [])[:top_k]
 
 
-    def filter_and_rank(self, origin, destination, user_id=None, semantic_query=None):
+    def filter_and_rank(self, origin, destination, user_id=None, semantic_query=None, explain=False):
         """
         Main entry point. Filters flights by route, applies recommendation logic, 
         and returns categorized results with top 20 recommendations.
+        LLM explanations are left to the caller, who can explain just the flights it shows
+        with attach_llm_explanations; explain=True explains the top 20 and a few bad options here.
         """
-        # 1. Filter by Route (Case insensitive) & Deep Copy to prevent shared state issues
-        relevant_flights = [
-            copy.deepcopy(f) for f in self.flights 
-            if f['origin'].upper() == origin.upper() and f['destination'].upper() == destination.upper()
-        ]
+        results, jobs, market_stats, user_prefs = self._rank(origin, destination, user_id, semantic_query)
+        if not explain:
+            return results
         
-        if not relevant_flights:
-            return {"error": "No flights found for this route."}
+        # Explain concurrently, since each LLM call is I/O-bound
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = {
+                executor.submit(
+                    self.llm_service.generate_explanation, flight, market_stats, user_prefs, status=status
+                ): flight
+                for flight, status in jobs
+            }
+            for future in as_completed(futures):
+                futures[future]['llm_explanation'] = future.result()
+        
+        return results
 
-        # 1.5 Semantic Filtering
-        if semantic_query:
-            criteria = self.llm_service.parse_search_query(semantic_query)
-            print(f"Semantic Criteria: {criteria}")
-            
-            filtered = []
-            for f in relevant_flights:
-                keep = True
-                
-                # Max Price
-                if 'max_price' in criteria and f['price'] > criteria['max_price']:
-                    keep = False
-                    
-                # Max Stops
-                if 'max_stops' in criteria and f['stops'] > criteria['max_stops']:
-                    keep = False
-                    
-                # Time of Day (Approximate)
-                if 'time_of_day' in criteria:
-                    hour = int(f['departure_time'].split('T')[1].split(':')[0])
-                    period = criteria['time_of_day']
-                    if period == 'morning' and not (5 <= hour < 12): keep = False
-                    elif period == 'afternoon' and not (12 <= hour < 17): keep = False
-                    elif period == 'evening' and not (17 <= hour < 21): keep = False
-                    elif period == 'night' and not (21 <= hour or hour < 5): keep = False
-                
-                if keep:
-                    f['boost_reason'] = f"Matches '{semantic_query}'"
-                    filtered.append(f)
-            
-            relevant_flights = filtered
-            
-            if not relevant_flights:
-                return {"error": f"No flights match your smart search: {semantic_query}"}
+    async def filter_and_rank_async(self, origin, destination, user_id=None, semantic_query=None, explain=False):
+        """
+        Async variant of filter_and_rank: the LLM explanations are gathered as coroutines
+        (Gemini REST via aiohttp when available) instead of running in a thread pool.
+        """
+        results, jobs, market_stats, user_prefs = self._rank(origin, destination, user_id, semantic_query)
+        if not explain:
+            return results
         
-        # 2. Identify Bad Options
-        relevant_flights = self.identify_bad_options(relevant_flights)
+        explanations = await self.llm_service.generate_explanations_async(jobs, market_stats, user_prefs)
+        for (flight, _), explanation in zip(jobs, explanations):
+            flight['llm_explanation'] = explanation
         
-        # 3. Apply Recommendation Logic
-        if user_id:
-            ranked_flights = self.recommend_login(user_id, relevant_flights)
-        else:
-            ranked_flights = self.recommend_guest(relevant_flights)
+        return results
+
+    def attach_llm_explanations(self, flights, market_stats, user_id=None):
+        """
+        Explains a list of result flights in one concurrent batch and writes
+        flight['llm_explanation'] in place. Flags from filter_and_rank pick the status:
+        bad options are explained as "Avoid", the rest as "Recommended".
+        
+        Args:
+            flights (list): Flight dicts from filter_and_rank results.
+            market_stats (dict): results['metadata']['market_stats'] of the same search.
+            user_id (str): Logged-in user whose preferences are mentioned (optional).
+        """
+        asyncio.run(self.attach_llm_explanations_async(flights, market_stats, user_id))
+
+    async def attach_llm_explanations_async(self, flights, market_stats, user_id=None):
+        """Async variant of attach_llm_explanations, for callers already running an event loop."""
+        # A flight listed twice (e.g. both recommended and a bad option) is explained once
+        unique = list({f['flight_id']: f for f in flights}.values())
+        jobs = [(f, self._explanation_status(f)) for f in unique]
+        explanations = await self.llm_service.generate_explanations_async(
+            jobs, market_stats, self._user_prefs(user_id)
+        )
+        for flight, explanation in zip(unique, explanations):
+            flight['llm_explanation'] = explanation
+
+    @staticmethod
+    def _explanation_status(flight):
+        """Status a result flight is explained with: bad options as "Avoid", the rest as "Recommended"."""
+        return "Avoid" if flight.get('is_bad_option') else "Recommended"
+
+    def _user_prefs(self, user_id):
+        """Stated preferences of a logged-in user, or None for guests/unknown users."""
+        user = self.user_map.get(user_id) if user_id else None
+        return user.get('preferences') if user else None
+
+    def _rank(self, origin, destination, user_id, semantic_query):
+        """
+        Filtering and ranking part of filter_and_rank. Returns (results, jobs, market_stats,
+        user_prefs) where jobs lists the (flight, status) pairs that still need an LLM explanation.
+        """
+        # 1. Look up Route (Case insensitive); repeated searches reuse the memoized ranking
+        ranking = self._rank_cached((origin.upper(), destination.upper()), user_id, semantic_query)
+        if isinstance(ranking, str):
+            return {"error": ranking}, [], None, None
+        relevant_idx, scores, annotations = ranking.idx, ranking.scores, ranking.annotations
+
+        # Materialize each returned flight once, so all categories share the same dict.
+        # Annotations are merged into fresh dicts, so neither the shared flight data nor the
+        # memoized ranking is ever mutated.
+        rows = {}
+        def row(pos):
+            i = int(relevant_idx[pos])
+            if i not in rows:
+                rows[i] = {
+                    **self.flights[i].to_dict(),
+                    'is_bad_option': False,
+                    'bad_option_reason': None,
+                    **annotations.get(i, {}),
+                    'score': float(scores[pos]),
+                }
+            return rows[i]
             
         # 4. Extract categories
-        fastest = sorted(relevant_flights, key=lambda x: x['duration_minutes'])[:20]
-        cheapest = sorted(relevant_flights, key=lambda x: x['price'])[:20]
-        
-        top_20 = ranked_flights[:20]
+        top_20 = [row(pos) for pos in ranking.top]
+        fastest = [row(pos) for pos in ranking.fastest]
+        cheapest = [row(pos) for pos in ranking.cheapest]
         
-        # 5. Generate Explanations with LLM
-        # Calculate market stats for context
-        prices = [f['price'] for f in relevant_flights]
-        durations = [f['duration_minutes'] for f in relevant_flights]
+        # 5. Collect flights to explain with the LLM
+        # Market stats for context
         market_stats = {
-            "avg_price": statistics.mean(prices) if prices else 0,
-            "avg_duration": statistics.mean(durations) if durations else 0
+            "avg_price": ranking.route_stats['avg_price'],
+            "avg_duration": ranking.route_stats['avg_duration']
         }
         
-        user_prefs = None
-        if user_id:
-            user = self.user_map.get(user_id)
-            if user:
-                user_prefs = user.get('preferences')
-
-        # Explain Top 5
-        for flight in top_20[:20]:
-            explanation = self.llm_service.generate_explanation(
-                flight, market_stats, user_prefs, status="Recommended"
-            )
-            flight['llm_explanation'] = explanation
-            
-        # Explain Bad Options 
-        bad_options = [f for f in relevant_flights if f.get('is_bad_option')]
-        # Limit to explaining a few bad ones 
-        for flight in bad_options[:3]:
-             explanation = self.llm_service.generate_explanation(
-                flight, market_stats, user_prefs, status="Avoid"
-            )
-             flight['llm_explanation'] = explanation
+        user_prefs = self._user_prefs(user_id)
+
+        bad_options = [row(pos) for pos in ranking.bad]
+
+        # Explain Top 20 and a few Bad Options, once per flight
+        explained = {f['flight_id']: f for f in top_20 + bad_options[:3]}
+        jobs = [(f, self._explanation_status(f)) for f in explained.values()]
         
-        return {
+        results = {
             "metadata": {
                 "origin": origin,
                 "destination": destination,
-                "total_found": len(relevant_flights),
+                "total_found": len(relevant_idx),
                 "user_type": "logged_in" if user_id else "guest",
                 "market_stats": market_stats
             },
@@ -274,6 +610,84 @@ class FlightRecommendationEngine:
             "fastest": fastest,
             "bad_options_sample": bad_options[:5]
         }
+        return results, jobs, market_stats, user_prefs
+
+    def _rank_uncached(self, route, user_id, semantic_query):
+        """
+        Pure ranking step of _rank, memoized per engine by _rank_cached: depends only on its
+        arguments and the loaded data. Returns a _Ranking, or an error message string.
+        """
+        relevant_idx = self._route_index.get(route, np.empty(0, dtype=np.intp))
+        
+        if len(relevant_idx) == 0:
+            return "No flights found for this route."
+
+        # Per-request annotations (boost_reason, is_bad_option, ...) keyed by flight index
+        annotations = defaultdict(dict)
+
+        # 1.5 Semantic Filtering
+        if semantic_query:
+            criteria = self.llm_service.parse_search_query(semantic_query)
+            print(f"Semantic Criteria: {criteria}")
+            
+            # Each criterion narrows a boolean mask over the candidates
+            mask = np.ones(len(relevant_idx), dtype=bool)
+            
+            # Max Price
+            if 'max_price' in criteria:
+                mask &= self._prices[relevant_idx] <= criteria['max_price']
+                
+            # Max Stops
+            if 'max_stops' in criteria:
+                mask &= self._stops[relevant_idx] <= criteria['max_stops']
+                
+            # Time of Day (Approximate)
+            if 'time_of_day' in criteria:
+                hours = self._hours[relevant_idx]
+                period = criteria['time_of_day']
+                if period == 'morning': mask &= (hours >= 5) & (hours < 12)
+                elif period == 'afternoon': mask &= (hours >= 12) & (hours < 17)
+                elif period == 'evening': mask &= (hours >= 17) & (hours < 21)
+                elif period == 'night': mask &= (hours >= 21) | (hours < 5)
+            
+            relevant_idx = relevant_idx[mask]
+            for i in relevant_idx.tolist():
+                annotations[i]['boost_reason'] = f"Matches '{semantic_query}'"
+            
+            if len(relevant_idx) == 0:
+                return f"No flights match your smart search: {semantic_query}"
+        
+        # Route-wide stats are precomputed; a semantic filter narrows the set, so recompute for it
+        route_stats = self._compute_market_stats(relevant_idx) if semantic_query else self._market_stats[route]
+        
+        # 2. Identify Bad Options
+        bad_mask, bad_reasons = self.identify_bad_options(relevant_idx, route_stats)
+        for i, reason in bad_reasons.items():
+            annotations[i]['is_bad_option'] = True
+            annotations[i]['bad_option_reason'] = reason
+        
+        # 3. Apply Recommendation Logic
+        if user_id:
+            scores, top_positions = self.recommend_login(user_id, relevant_idx, annotations)
+        else:
+            scores, top_positions = self.recommend_guest(relevant_idx)
+        
+        ranking = _Ranking(
+            idx=relevant_idx,
+            scores=scores,
+            annotations=dict(annotations),
+            top=top_positions,
+            fastest=self._smallest_k(self._durations[relevant_idx], 20),
+            cheapest=self._smallest_k(self._prices[relevant_idx], 20),
+            bad=np.flatnonzero(bad_mask)[:5],
+            route_stats=route_stats,
+        )
+        # ranking.idx is left writeable: without a semantic filter it is the shared
+        # _route_index[route] array, and flagging it read-only would make numba compile a second
+        # (read-only) specialization of the scoring kernel for every later search of the route
+        for array in (ranking.scores, ranking.top, ranking.fastest, ranking.cheapest, ranking.bad):
+            array.flags.writeable = False
+        return ranking
 
 if __name__ == "__main__":
     # Quick sanity check
@@ -1,6 +1,8 @@
 import os
 import sys
+import asyncio
 from recommendation_engine import FlightRecommendationEngine
+from llm_service import LLMService, CachedLLMService, SemanticCacheLLMService
 
 # ==========================================
 # ENTER YOUR GEMINI API KEY HERE
@@ -8,15 +10,25 @@ from recommendation_engine import FlightRecommendationEngine
 GEMINI_API_KEY = "YOUR GEMINI KEY"
 # ==========================================
 
-def print_flight_summary(flight, rank=None):
+def format_flight_summary(flight, rank=None):
+    """Returns the (possibly multi-line) summary of a flight, without a trailing newline."""
+    # Each field is looked up once
+    is_bad = flight.get('is_bad_option')
+    boost = flight.get('boost_reason')
+    explanation = flight.get('llm_explanation')
     prefix = f"{rank}. " if rank else ""
-    bad_flag = "[BAD]" if flight.get('is_bad_option') else ""
-    boost = f"(Boost: {flight.get('boost_reason')})" if flight.get('boost_reason') else ""
-    print(f"{prefix}{bad_flag} {flight['airline']}, ${flight['price']}, {flight['duration_minutes']}m, {flight['stops']} stops {boost}")
-    if flight.get('llm_explanation'):
-        print(f"   [AI Explanation]: {flight['llm_explanation']}")
+    bad_flag = "[BAD]" if is_bad else ""
+    boost_text = f"(Boost: {boost})" if boost else ""
+    lines = [f"{prefix}{bad_flag} {flight['airline']}, ${flight['price']}, {flight['duration_minutes']}m, {flight['stops']} stops {boost_text}"]
+    if explanation:
+        lines.append(f"   [AI Explanation]: {explanation}")
+    return "\n".join(lines)
 
-def main():
+async def fetch_all_explanations(engine, flights, market_stats, user_id=None):
+    """Fetches the LLM explanations of all flights about to be printed concurrently."""
+    await engine.attach_llm_explanations_async(flights, market_stats, user_id=user_id)
+
+async def main():
     # Set the key in environment for LLMService to pick it up
     if GEMINI_API_KEY == "YOUR_API_KEY_HERE":
         print("Please edit this file and replace 'YOUR_API_KEY_HERE' with your actual Gemini API Key.")
@@ -25,7 +37,12 @@ def main():
         os.environ["GOOGLE_API_KEY"] = GEMINI_API_KEY
         print("Running with REAL GEMINI API...\n")
 
-    engine = FlightRecommendationEngine('user_profiles.json', 'flights_data.json')
+    # Explanations persist on disk, so repeated runs skip Gemini for flights seen before;
+    # near-duplicate flights reuse one explanation (the semantic layer sits on top, so a
+    # reused answer is never persisted under another flight's key). Nothing here is
+    # user-facing, so the Gemini calls go through the cheaper Flex tier.
+    llm_service = SemanticCacheLLMService(CachedLLMService(LLMService(service_tier="flex")))
+    engine = FlightRecommendationEngine('user_profiles.json', 'flights_data.json', llm_service=llm_service)
     engine.load_data()
     
     print("\n" + "="*50)
@@ -38,13 +55,22 @@ def main():
         print(results['error'])
         return
 
-    print("\nTop 3 Recommended:")
+    # Explain only the flights printed below, in one concurrent batch
+    await fetch_all_explanations(
+        engine,
+        results['recommended'] + results['bad_options_sample'][:1],
+        results['metadata']['market_stats'],
+    )
+
+    buf = ["\nTop 3 Recommended:"]
     for i, f in enumerate(results['recommended'], 1):
-        print_flight_summary(f, i)
+        buf.append(format_flight_summary(f, i))
         
-    print("\nBad Option Example:")
+    buf.append("\nBad Option Example:")
     if 'bad_options_sample' in results and results['bad_options_sample']:
-        print_flight_summary(results['bad_options_sample'][0])
+        buf.append(format_flight_summary(results['bad_options_sample'][0]))
+    # One write for the whole listing instead of one print per line
+    sys.stdout.write("\n".join(buf) + "\n")
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -0,0 +1,76 @@
+# Regression test: the NumPy ranking must match the original sorted()-based ranking
+
+import os
+import unittest
+from collections import Counter, defaultdict
+from recommendation_engine import FlightRecommendationEngine, WEIGHT_PRICE, WEIGHT_DURATION, WEIGHT_STOPS
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+# Logged-in users checked on every route (guests are checked on every route too)
+LOGGED_IN_USERS_CHECKED = 5
+
+
+def reference_scores(flights, user):
+    """Scores flights the way the original recommend_guest/recommend_login did."""
+    preferred_airlines = set()
+    prefers_direct = False
+    if user:
+        history = user.get('history', [])
+        airline_counts = Counter(r['airline'] for r in history if 'airline' in r)
+        direct_flight_count = sum(1 for r in history if 'airline' in r and r.get('stops', 1) == 0)
+        preferred_airlines = {airline for airline, count in airline_counts.items() if count >= 3}
+        prefers_direct = bool(history) and (direct_flight_count / len(history)) > 0.5
+
+    scores = []
+    for f in flights:
+        score = (f.price * WEIGHT_PRICE) + (f.duration_minutes * WEIGHT_DURATION) + (f.stops * WEIGHT_STOPS)
+        multiplier = 1.0
+        if f.airline in preferred_airlines:
+            multiplier *= 0.8
+        if prefers_direct and f.stops == 0:
+            multiplier *= 0.8
+        scores.append(score * multiplier)
+    return scores
+
+
+class RankingRegressionTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = FlightRecommendationEngine(
+            os.path.join(DATA_DIR, 'user_profiles.json'), os.path.join(DATA_DIR, 'flights_data.json')
+        )
+        cls.engine.load_data()
+        cls.routes = defaultdict(list)
+        for f in cls.engine.flights:
+            cls.routes[(f.origin, f.destination)].append(f)
+        logged_in = [u for u in cls.engine.users if u['user_type'] == 'logged_in']
+        cls.users = [None] + logged_in[:LOGGED_IN_USERS_CHECKED]
+
+    def assert_matches_reference(self, route, flights, user):
+        user_id = user['user_id'] if user else None
+        results = self.engine.filter_and_rank(*route, user_id=user_id)
+
+        # sorted() is stable, so ties keep the file order
+        scores = reference_scores(flights, user)
+        by_score = sorted(range(len(flights)), key=lambda i: scores[i])
+        expected = {
+            'recommended': [flights[i].flight_id for i in by_score[:20]],
+            'cheapest': [f.flight_id for f in sorted(flights, key=lambda f: f.price)[:20]],
+            'fastest': [f.flight_id for f in sorted(flights, key=lambda f: f.duration_minutes)[:20]],
+        }
+        for category, flight_ids in expected.items():
+            self.assertEqual(
+                [f['flight_id'] for f in results[category]], flight_ids,
+                f"{category} differs for {route}, user {user_id}"
+            )
+
+    def test_rankings_match_stable_sort(self):
+        for route, flights in self.routes.items():
+            for user in self.users:
+                with self.subTest(route=route, user=user and user['user_id']):
+                    self.assert_matches_reference(route, flights, user)
+
+
+if __name__ == "__main__":
+    unittest.main()